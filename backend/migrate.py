@@ -0,0 +1,177 @@
+"""One-off data migrations for databases created before the current schema.
+
+Run once per deploy, before starting the workers:
+
+    python migrate.py
+
+Each migration records itself in the ``migrations`` collection when it completes
+and is skipped on later runs, so the app itself never scans for legacy documents.
+"""
+import asyncio
+from datetime import datetime, timezone
+
+from bson import ObjectId
+from fastapi import HTTPException
+from pymongo import ReplaceOne, UpdateOne
+
+from server import client, db, logger, save_avatar
+
+
+async def backfill_search_fields():
+    # Users created before the lowercased search fields existed; lowercased in Python like
+    # new writes and the search query, since Mongo's $toLower only folds ASCII
+    updates = [
+        UpdateOne({"_id": user["_id"]}, {"$set": {
+            "profile_name_lower": user["profile_name"].lower(),
+            "handle_lower": user["handle"].lower()
+        }})
+        async for user in db.users.find({"handle_lower": {"$exists": False}}, {"profile_name": 1, "handle": 1})
+    ]
+    if updates:
+        await db.users.bulk_write(updates, ordered=False)
+
+
+async def backfill_post_user_refs():
+    # Posts created before user references were stored as ObjectId
+    await asyncio.gather(*(
+        db.posts.update_many(
+            {field: {"$type": "string", "$regex": "^[0-9a-fA-F]{24}$"}},
+            [{"$set": {field: {"$toObjectId": f"${field}"}}}]
+        )
+        for field in ("user_id", "restaurant_tagged_id")
+    ))
+
+
+async def backfill_follows():
+    # Users from before the follows collection keep their edges in followers/following arrays;
+    # each following entry becomes an edge and the mirrored followers arrays are dropped
+    now = datetime.now(timezone.utc)
+    cursor = db.users.find(
+        {"$or": [{"following": {"$exists": True}}, {"followers": {"$exists": True}}]},
+        {"following": 1}
+    )
+    async for user in cursor:
+        edges = [
+            UpdateOne(
+                {"follower_id": user["_id"], "followee_id": ObjectId(followee_id)},
+                {"$setOnInsert": {"created_at": now}},
+                upsert=True
+            )
+            for followee_id in set(user.get("following") or [])
+            if ObjectId.is_valid(followee_id)
+        ]
+        if edges:
+            await db.follows.bulk_write(edges, ordered=False)
+        await db.users.update_one({"_id": user["_id"]}, {"$unset": {"following": "", "followers": ""}})
+
+
+async def backfill_comments():
+    # Posts from before the comments collection embed their comments in the post document;
+    # upserting on the comment's own fields keeps a rerun from duplicating them
+    async for post in db.posts.find({"comments": {"$exists": True}}, {"comments": 1}):
+        comments = post.get("comments") or []
+        moves = []
+        for comment in comments:
+            comment_obj = {
+                "post_id": str(post["_id"]),
+                "user_id": ObjectId(comment["user_id"]) if ObjectId.is_valid(comment["user_id"]) else comment["user_id"],
+                "text": comment["text"],
+                "created_at": comment["created_at"]
+            }
+            moves.append(ReplaceOne(comment_obj, comment_obj, upsert=True))
+        if moves:
+            await db.comments.bulk_write(moves, ordered=False)
+        # Matching on the array makes the count and unset apply at most once per post
+        result = await db.posts.update_one(
+            {"_id": post["_id"], "comments": {"$exists": True}},
+            {"$inc": {"comment_count": len(comments)}, "$unset": {"comments": ""}}
+        )
+        if result.modified_count != 1:
+            logger.warning("Comments on post %s were already migrated", post["_id"])
+
+
+async def backfill_avatars():
+    # Users from before avatars were stored on disk carry them as base64 in the document
+    async for user in db.users.find({"avatar_base64": {"$exists": True}}, {"avatar_base64": 1}):
+        changes = {"$unset": {"avatar_base64": ""}}
+        if user.get("avatar_base64"):
+            try:
+                changes["$set"] = {"avatar_url": await save_avatar(str(user["_id"]), user["avatar_base64"])}
+            except HTTPException:
+                logger.warning("Leaving unreadable avatar in place for user %s", user["_id"])
+                continue
+        await db.users.update_one({"_id": user["_id"]}, changes)
+
+
+async def find_duplicates(collection, keys) -> list:
+    pipeline = [
+        {"$group": {"_id": {key: f"${key}" for key in keys}, "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}}
+    ]
+    return await collection.aggregate(pipeline, allowDiskUse=True).to_list(None)
+
+
+async def merge_duplicate_loyalty_points():
+    # The old find-then-insert redemption flow could create several rows per foodie and restaurant
+    for group in await find_duplicates(db.loyalty_points, ("foodie_id", "restaurant_id")):
+        rows = await db.loyalty_points.find({"_id": {"$in": group["ids"]}}).to_list(None)
+        keep, extra = rows[0], rows[1:]
+        changes = {
+            "$inc": {"points": sum(row.get("points", 0) for row in extra)},
+            "$push": {"transactions": {"$each": [t for row in extra for t in row.get("transactions", [])]}}
+        }
+        last_updated = [row["last_updated"] for row in rows if row.get("last_updated")]
+        if last_updated:
+            changes["$max"] = {"last_updated": max(last_updated)}
+        await db.loyalty_points.update_one({"_id": keep["_id"]}, changes)
+        await db.loyalty_points.delete_many({"_id": {"$in": [row["_id"] for row in extra]}})
+
+
+async def create_unique_indexes():
+    # Duplicate users cannot be merged automatically, so conflicting values are reported
+    # and their index left unbuilt; the migration reruns until they are resolved by hand
+    await merge_duplicate_loyalty_points()
+    await db.loyalty_points.create_index([("foodie_id", 1), ("restaurant_id", 1)], unique=True)
+
+    completed = True
+    for field in ("email", "handle"):
+        duplicates = await find_duplicates(db.users, (field,))
+        if duplicates:
+            logger.error(
+                "Not creating unique users.%s index; duplicate values: %s",
+                field, ", ".join(str(group["_id"][field]) for group in duplicates)
+            )
+            completed = False
+            continue
+        await db.users.create_index([(field, 1)], unique=True)
+    return completed
+
+
+MIGRATIONS = [
+    create_unique_indexes,
+    backfill_search_fields,
+    backfill_post_user_refs,
+    backfill_follows,
+    backfill_comments,
+    backfill_avatars,
+]
+
+
+async def run_migrations():
+    for migration in MIGRATIONS:
+        name = migration.__name__
+        if await db.migrations.find_one({"_id": name}, {"_id": 1}):
+            logger.info("Skipping %s; already applied", name)
+            continue
+        logger.info("Running %s", name)
+        if await migration() is False:
+            logger.warning("%s did not complete; it will run again next time", name)
+            continue
+        await db.migrations.insert_one({"_id": name, "applied_at": datetime.now(timezone.utc)})
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(run_migrations())
+    finally:
+        client.close()
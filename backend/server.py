@@ -1,58 +1,115 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header
 from dotenv import load_dotenv
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from fastapi.staticfiles import StaticFiles
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import re
+import asyncio
 import logging
+import threading
+import time
 from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional, Dict, Any
-from datetime import datetime, timedelta
+from typing import List, Optional, Dict, Any, AsyncIterator
+from datetime import datetime, timedelta, timezone
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 import jwt
+import orjson
+from cachetools import TTLCache
 from passlib.context import CryptContext
 from cryptography.fernet import Fernet
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 import base64
+import functools
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(
+    mongo_url,
+    maxPoolSize=int(os.environ.get('MONGO_POOL', '50')),
+    minPoolSize=int(os.environ.get('MONGO_MIN_POOL', '10')),
+    serverSelectionTimeoutMS=3000,
+    compressors=os.environ.get('MONGO_COMPRESSORS', 'zstd,zlib')
+)
 db = client[os.environ.get('DB_NAME', 'foodies_circle')]
 
 # Security setup
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '10'))
+pwd_context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=BCRYPT_ROUNDS, deprecated="auto")
 SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key-change-in-production')
 ALGORITHM = "HS256"
 
-# Fernet encryption setup
-FERNET_KEY = os.environ.get('FERNET_KEY', Fernet.generate_key().decode())
+# Verified token payloads, kept briefly so revocation latency stays bounded
+_jwt_cache = TTLCache(maxsize=10_000, ttl=60)
+_jwt_cache_lock = threading.Lock()
+
+# Promo code encryption setup (AES-256-GCM; Fernet is kept to read legacy codes)
+APP_ENV = os.environ.get('APP_ENV', 'production')
+FERNET_KEY = os.environ.get('FERNET_KEY')
+if not FERNET_KEY:
+    # A generated key is private to this process: other workers, and this one after a
+    # restart, would reject every promo code it issues
+    if APP_ENV != 'development':
+        raise RuntimeError("FERNET_KEY must be set unless APP_ENV=development")
+    FERNET_KEY = Fernet.generate_key().decode()
+    logging.getLogger(__name__).warning(
+        "FERNET_KEY is not set; using a generated key, so promo codes will not survive a restart "
+        "or work across workers"
+    )
 fernet = Fernet(FERNET_KEY.encode() if isinstance(FERNET_KEY, str) else FERNET_KEY)
+# Derive a separate AES-GCM key so the Fernet key material is not reused across algorithms
+aead = AESGCM(HKDF(
+    algorithm=hashes.SHA256(),
+    length=32,
+    salt=None,
+    info=b"promo-aesgcm"
+).derive(base64.urlsafe_b64decode(FERNET_KEY)))
+PROMO_NONCE_SIZE = 12
+
+# Avatar storage; avatars are served as static files instead of riding along in user documents
+AVATAR_DIR = Path(os.environ.get('AVATAR_DIR', ROOT_DIR / 'avatars'))
+AVATAR_DIR.mkdir(parents=True, exist_ok=True)
+AVATAR_URL_PREFIX = "/api/avatars"
+AVATAR_MAX_BYTES = int(os.environ.get('AVATAR_MAX_BYTES', str(2 * 1024 * 1024)))
 
 # Create the main app
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 api_router = APIRouter(prefix="/api")
 
 # Helper functions
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+# bcrypt is CPU-bound, so hashing runs in a worker thread to keep the event loop free
+async def hash_password(password: str) -> str:
+    return await asyncio.to_thread(pwd_context.hash, password)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await asyncio.to_thread(pwd_context.verify, plain_password, hashed_password)
 
 def create_token(user_id: str, user_type: str) -> str:
     payload = {
         "user_id": user_id,
         "user_type": user_type,
-        "exp": datetime.utcnow() + timedelta(days=30)
+        "exp": datetime.now(timezone.utc) + timedelta(days=30)
     }
     return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
 
 def verify_token(token: str) -> Dict:
+    with _jwt_cache_lock:
+        cached = _jwt_cache.get(token)
+    if cached and cached["exp"] > time.time():
+        return cached
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        with _jwt_cache_lock:
+            _jwt_cache[token] = payload
         return payload
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
@@ -64,18 +121,29 @@ async def get_current_user(authorization: Optional[str] = Header(None)):
         raise HTTPException(status_code=401, detail="Not authenticated")
     token = authorization.replace("Bearer ", "")
     payload = verify_token(token)
-    return payload
+    return {**payload, "user_oid": ObjectId(payload["user_id"])}
 
 def encrypt_promo_code(promo_text: str, promoter_id: str, restaurant_id: str, post_id: str, dish_id: str = "") -> str:
     data = f"{promo_text}|{promoter_id}|{restaurant_id}|{post_id}|{dish_id}"
-    encrypted = fernet.encrypt(data.encode())
-    return base64.urlsafe_b64encode(encrypted).decode()
+    nonce = os.urandom(PROMO_NONCE_SIZE)
+    encrypted = aead.encrypt(nonce, data.encode(), None)
+    return base64.urlsafe_b64encode(nonce + encrypted).decode()
+
+@functools.lru_cache(maxsize=4096)
+def _decrypt_promo_fields(encrypted_code: str) -> tuple:
+    # Cached by ciphertext so rescans and retries of the same code skip the crypto;
+    # failures raise and are therefore never cached
+    decoded = base64.urlsafe_b64decode(encrypted_code.encode())
+    try:
+        decrypted = aead.decrypt(decoded[:PROMO_NONCE_SIZE], decoded[PROMO_NONCE_SIZE:], None).decode()
+    except InvalidTag:
+        # Codes issued before the switch to AES-GCM are base64-wrapped Fernet tokens
+        decrypted = fernet.decrypt(decoded).decode()
+    return tuple(decrypted.split("|"))
 
 def decrypt_promo_code(encrypted_code: str) -> Dict:
     try:
-        decoded = base64.urlsafe_b64decode(encrypted_code.encode())
-        decrypted = fernet.decrypt(decoded).decode()
-        parts = decrypted.split("|")
+        parts = _decrypt_promo_fields(encrypted_code)
         return {
             "promo_text": parts[0],
             "promoter_id": parts[1],
@@ -86,6 +154,131 @@ def decrypt_promo_code(encrypted_code: str) -> Dict:
     except Exception as e:
         raise HTTPException(status_code=400, detail="Invalid promo code")
 
+def avatar_extension(data: bytes) -> Optional[str]:
+    """Identify a supported image format from its leading bytes."""
+    if data.startswith(b"\xff\xd8\xff"):
+        return "jpg"
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if data.startswith((b"GIF87a", b"GIF89a")):
+        return "gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+def remove_avatar_files(user_id: str) -> None:
+    for path in AVATAR_DIR.glob(f"{user_id}.*"):
+        path.unlink(missing_ok=True)
+
+async def save_avatar(user_id: str, avatar_base64: str) -> str:
+    """Write an uploaded avatar to disk and return the URL it is served from."""
+    # Reject oversized uploads before decoding them; base64 inflates by 4/3
+    if len(avatar_base64) > (AVATAR_MAX_BYTES + 2) // 3 * 4:
+        raise HTTPException(status_code=413, detail="Avatar image too large")
+    try:
+        data = base64.b64decode(avatar_base64, validate=True)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid avatar image")
+    extension = avatar_extension(data)
+    if not extension:
+        raise HTTPException(status_code=400, detail="Avatar must be a JPEG, PNG, GIF or WebP image")
+    
+    filename = f"{user_id}.{extension}"
+    
+    def write():
+        # A replaced avatar may have been stored under a different extension
+        remove_avatar_files(user_id)
+        (AVATAR_DIR / filename).write_bytes(data)
+    
+    await asyncio.to_thread(write)
+    # Version the URL so clients pick up a replaced avatar
+    return f"{AVATAR_URL_PREFIX}/{filename}?v={int(time.time())}"
+
+USER_SUMMARY_PROJECTION = {"profile_name": 1, "handle": 1, "avatar_url": 1, "user_type": 1}
+USER_PROFILE_PROJECTION = {"password_hash": 0, "avatar_base64": 0, "profile_name_lower": 0, "handle_lower": 0}
+# Comments live in the comments collection; older posts may still embed them until backfilled
+POST_PROJECTION = {"comments": 0}
+
+async def fetch_users_by_id(user_ids, projection: Optional[Dict] = None) -> Dict[str, Dict]:
+    """Load many users in one round-trip, keyed by their string id."""
+    ids = [ObjectId(uid) for uid in set(user_ids) if uid]
+    if not ids:
+        return {}
+    cursor = db.users.find({"_id": {"$in": ids}}, projection or USER_SUMMARY_PROJECTION)
+    return {str(user["_id"]): user async for user in cursor}
+
+def parse_object_id(value: str, name: str) -> ObjectId:
+    """Parse a client-supplied id, rejecting malformed input with a 400 instead of a 500."""
+    if not ObjectId.is_valid(value):
+        raise HTTPException(status_code=400, detail=f"Invalid {name}")
+    return ObjectId(value)
+
+def serialize_post(post: Dict) -> Dict:
+    """Convert the ObjectId fields of a post document to strings for the response."""
+    post["_id"] = str(post["_id"])
+    post["user_id"] = str(post["user_id"])
+    if post.get("restaurant_tagged_id"):
+        post["restaurant_tagged_id"] = str(post["restaurant_tagged_id"])
+    return post
+
+def feed_pipeline(query: Dict, skip: int, limit: int) -> List[Dict]:
+    """Aggregate a page of feed posts joined with their author and promo code server-side."""
+    return [
+        {"$match": query},
+        {"$sort": {"created_at": -1}},
+        {"$skip": skip},
+        {"$limit": limit},
+        {"$lookup": {
+            "from": "users",
+            "localField": "user_id",
+            "foreignField": "_id",
+            "pipeline": [{"$project": USER_SUMMARY_PROJECTION}],
+            "as": "user"
+        }},
+        {"$unwind": {"path": "$user", "preserveNullAndEmptyArrays": True}},
+        # promo_code_id is stored as a string
+        {"$addFields": {"promo_oid": {
+            "$convert": {"input": "$promo_code_id", "to": "objectId", "onError": None, "onNull": None}
+        }}},
+        {"$lookup": {
+            "from": "promocodes",
+            "localField": "promo_oid",
+            "foreignField": "_id",
+            "pipeline": [{"$project": {"code_encrypted": 1, "offer_description": 1}}],
+            "as": "promo"
+        }},
+        {"$unwind": {"path": "$promo", "preserveNullAndEmptyArrays": True}},
+        {"$addFields": {
+            "promo_code": "$promo.code_encrypted",
+            "offer_description": "$promo.offer_description"
+        }},
+        {"$project": {"promo": 0, "promo_oid": 0, **POST_PROJECTION}}
+    ]
+
+def serialize_feed_post(post: Dict) -> Dict:
+    serialize_post(post)
+    if post.get("user"):
+        post["user"]["_id"] = str(post["user"]["_id"])
+    return post
+
+async def stream_feed(first: Optional[Dict], cursor) -> AsyncIterator[bytes]:
+    """Emit feed posts as a JSON array, encoding each post as it arrives from the cursor."""
+    yield b"["
+    if first is not None:
+        yield orjson.dumps(serialize_feed_post(first))
+        async for post in cursor:
+            yield b"," + orjson.dumps(serialize_feed_post(post))
+    yield b"]"
+
+async def feed_response(cursor) -> StreamingResponse:
+    # The cursor is lazy; pull the first post before the 200 goes out so query
+    # failures still surface as error responses rather than a truncated body
+    try:
+        first = await cursor.next()
+    except StopAsyncIteration:
+        first = None
+    return StreamingResponse(stream_feed(first, cursor), media_type="application/json")
+
 # Pydantic Models
 class UserRegister(BaseModel):
     email: EmailStr
@@ -137,20 +330,32 @@ class PromoRedeem(BaseModel):
 # Auth Endpoints
 @api_router.post("/register")
 async def register(user: UserRegister):
-    # Check if user exists
-    existing_user = await db.users.find_one({"$or": [{"email": user.email}, {"handle": user.handle}]})
+    # Check if user exists before paying for the password hash; the unique
+    # indexes on email and handle catch anything that races past this check
+    existing_user = await db.users.find_one({"$or": [{"email": user.email}, {"handle": user.handle}]}, {"_id": 1})
     if existing_user:
         raise HTTPException(status_code=400, detail="Email or handle already exists")
     
     # Create user
     user_dict = user.dict()
-    user_dict["password_hash"] = hash_password(user.password)
+    user_dict["_id"] = ObjectId()
+    user_dict["password_hash"] = await hash_password(user.password)
     del user_dict["password"]
-    user_dict["followers"] = []
-    user_dict["following"] = []
-    user_dict["created_at"] = datetime.utcnow()
+    avatar_base64 = user_dict.pop("avatar_base64", None)
+    if avatar_base64:
+        user_dict["avatar_url"] = await save_avatar(str(user_dict["_id"]), avatar_base64)
+    # Lowercased copies back the indexed, case-insensitive user search
+    user_dict["profile_name_lower"] = user.profile_name.lower()
+    user_dict["handle_lower"] = user.handle.lower()
+    user_dict["created_at"] = datetime.now(timezone.utc)
     
-    result = await db.users.insert_one(user_dict)
+    try:
+        result = await db.users.insert_one(user_dict)
+    except DuplicateKeyError:
+        if avatar_base64:
+            # The account was never created, so its avatar file would be orphaned
+            await asyncio.to_thread(remove_avatar_files, str(user_dict["_id"]))
+        raise HTTPException(status_code=400, detail="Email or handle already exists")
     user_id = str(result.inserted_id)
     
     token = create_token(user_id, user.user_type)
@@ -165,8 +370,11 @@ async def register(user: UserRegister):
 
 @api_router.post("/login")
 async def login(credentials: UserLogin):
-    user = await db.users.find_one({"email": credentials.email})
-    if not user or not verify_password(credentials.password, user["password_hash"]):
+    user = await db.users.find_one(
+        {"email": credentials.email},
+        {"password_hash": 1, "user_type": 1, "profile_name": 1, "handle": 1, "avatar_url": 1}
+    )
+    if not user or not await verify_password(credentials.password, user["password_hash"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     user_id = str(user["_id"])
@@ -178,50 +386,65 @@ async def login(credentials: UserLogin):
         "user_type": user["user_type"],
         "profile_name": user["profile_name"],
         "handle": user["handle"],
-        "avatar_base64": user.get("avatar_base64")
+        "avatar_url": user.get("avatar_url")
     }
 
 @api_router.get("/me")
 async def get_me(current_user: Dict = Depends(get_current_user)):
-    user = await db.users.find_one({"_id": ObjectId(current_user["user_id"])})
+    user_oid = current_user["user_oid"]
+    user, follower_count, following_count = await asyncio.gather(
+        db.users.find_one({"_id": user_oid}, USER_PROFILE_PROJECTION),
+        db.follows.count_documents({"followee_id": user_oid}),
+        db.follows.count_documents({"follower_id": user_oid})
+    )
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
     user["_id"] = str(user["_id"])
-    user.pop("password_hash", None)
+    user["follower_count"] = follower_count
+    user["following_count"] = following_count
     return user
 
 # User Endpoints
 @api_router.get("/users/search")
 async def search_users(q: str, filter_type: Optional[str] = None):
+    q = q.strip()
+    if not q:
+        return []
+    
+    # Anchored prefix matches on the lowercased fields can use their indexes
+    prefix = {"$regex": f"^{re.escape(q.lower())}"}
     query = {"$or": [
-        {"profile_name": {"$regex": q, "$options": "i"}},
-        {"handle": {"$regex": q, "$options": "i"}}
+        {"profile_name_lower": prefix},
+        {"handle_lower": prefix}
     ]}
     
     if filter_type:
         query["user_type"] = filter_type
     
-    users = await db.users.find(query).limit(20).to_list(20)
+    users = await db.users.find(query, USER_PROFILE_PROJECTION).limit(20).to_list(20)
     
     for user in users:
         user["_id"] = str(user["_id"])
-        user.pop("password_hash", None)
     
     return users
 
 @api_router.get("/users/{user_id}")
 async def get_user(user_id: str):
-    user = await db.users.find_one({"_id": ObjectId(user_id)})
+    user_oid = ObjectId(user_id)
+    user, post_count, follower_count, following_count = await asyncio.gather(
+        db.users.find_one({"_id": user_oid}, USER_PROFILE_PROJECTION),
+        db.posts.count_documents({"user_id": user_oid}),
+        db.follows.count_documents({"followee_id": user_oid}),
+        db.follows.count_documents({"follower_id": user_oid})
+    )
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
     user["_id"] = str(user["_id"])
-    user.pop("password_hash", None)
-    
-    # Get post count
-    post_count = await db.posts.count_documents({"user_id": user_id})
     user["post_count"] = post_count
+    user["follower_count"] = follower_count
+    user["following_count"] = following_count
     
     return user
 
@@ -231,8 +454,17 @@ async def update_user(user_id: str, update: UserUpdate, current_user: Dict = Dep
         raise HTTPException(status_code=403, detail="Not authorized")
     
     update_dict = {k: v for k, v in update.dict().items() if v is not None}
+    avatar_base64 = update_dict.pop("avatar_base64", None)
+    if avatar_base64:
+        update_dict["avatar_url"] = await save_avatar(user_id, avatar_base64)
+    if "profile_name" in update_dict:
+        update_dict["profile_name_lower"] = update_dict["profile_name"].lower()
     if update_dict:
-        await db.users.update_one({"_id": ObjectId(user_id)}, {"$set": update_dict})
+        changes = {"$set": update_dict}
+        if avatar_base64:
+            # Drop any avatar blob left over from before avatars were stored on disk
+            changes["$unset"] = {"avatar_base64": ""}
+        await db.users.update_one({"_id": current_user["user_oid"]}, changes)
     
     return {"message": "User updated successfully"}
 
@@ -241,7 +473,7 @@ async def update_location(user_id: str, location: LocationUpdate, current_user:
     if current_user["user_id"] != user_id:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    user = await db.users.find_one({"_id": ObjectId(user_id)})
+    user = await db.users.find_one({"_id": current_user["user_oid"]}, {"user_type": 1, "restaurant_details": 1})
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -258,7 +490,7 @@ async def update_location(user_id: str, location: LocationUpdate, current_user:
     }
     
     await db.users.update_one(
-        {"_id": ObjectId(user_id)},
+        {"_id": current_user["user_oid"]},
         {"$set": {"restaurant_details": restaurant_details}}
     )
     
@@ -267,36 +499,19 @@ async def update_location(user_id: str, location: LocationUpdate, current_user:
 
 @api_router.post("/users/{user_id}/follow")
 async def follow_user(user_id: str, current_user: Dict = Depends(get_current_user)):
-    follower_id = current_user["user_id"]
-    
-    # Add to following list
-    await db.users.update_one(
-        {"_id": ObjectId(follower_id)},
-        {"$addToSet": {"following": user_id}}
-    )
-    
-    # Add to followers list
-    await db.users.update_one(
-        {"_id": ObjectId(user_id)},
-        {"$addToSet": {"followers": follower_id}}
+    # Upsert keeps repeated follows idempotent
+    await db.follows.update_one(
+        {"follower_id": current_user["user_oid"], "followee_id": ObjectId(user_id)},
+        {"$setOnInsert": {"created_at": datetime.now(timezone.utc)}},
+        upsert=True
     )
     
     return {"message": "Followed successfully"}
 
 @api_router.post("/users/{user_id}/unfollow")
 async def unfollow_user(user_id: str, current_user: Dict = Depends(get_current_user)):
-    follower_id = current_user["user_id"]
-    
-    # Remove from following list
-    await db.users.update_one(
-        {"_id": ObjectId(follower_id)},
-        {"$pull": {"following": user_id}}
-    )
-    
-    # Remove from followers list
-    await db.users.update_one(
-        {"_id": ObjectId(user_id)},
-        {"$pull": {"followers": follower_id}}
+    await db.follows.delete_one(
+        {"follower_id": current_user["user_oid"], "followee_id": ObjectId(user_id)}
     )
     
     return {"message": "Unfollowed successfully"}
@@ -304,14 +519,17 @@ async def unfollow_user(user_id: str, current_user: Dict = Depends(get_current_u
 # Post Endpoints
 @api_router.post("/posts")
 async def create_post(post: PostCreate, current_user: Dict = Depends(get_current_user)):
+    now = datetime.now(timezone.utc)
     post_dict = post.dict()
-    post_dict["user_id"] = current_user["user_id"]
+    post_dict["user_id"] = current_user["user_oid"]
+    if post.restaurant_tagged_id:
+        post_dict["restaurant_tagged_id"] = parse_object_id(post.restaurant_tagged_id, "restaurant_tagged_id")
     post_dict["post_type"] = "Promotion" if post.is_promotion_request else "Normal"
     post_dict["likes"] = []
-    post_dict["comments"] = []
+    post_dict["comment_count"] = 0
     post_dict["promotion_status"] = "Pending" if post.is_promotion_request else "N/A"
-    post_dict["created_at"] = datetime.utcnow()
-    post_dict["updated_at"] = datetime.utcnow()
+    post_dict["created_at"] = now
+    post_dict["updated_at"] = now
     
     result = await db.posts.insert_one(post_dict)
     post_id = str(result.inserted_id)
@@ -323,72 +541,35 @@ async def get_trending_feed(city: Optional[str] = None, skip: int = 0, limit: in
     query = {"promotion_status": {"$in": ["N/A", "Approved"]}}
     
     if city:
-        query["location.name"] = {"$regex": city, "$options": "i"}
-    
-    posts = await db.posts.find(query).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
-    
-    # Enrich posts with user data
-    for post in posts:
-        post["_id"] = str(post["_id"])
-        user = await db.users.find_one({"_id": ObjectId(post["user_id"])})
-        if user:
-            post["user"] = {
-                "_id": str(user["_id"]),
-                "profile_name": user["profile_name"],
-                "handle": user["handle"],
-                "avatar_base64": user.get("avatar_base64"),
-                "user_type": user["user_type"]
-            }
-        
-        # Get promo code if approved
-        if post.get("promo_code_id"):
-            promo = await db.promocodes.find_one({"_id": ObjectId(post["promo_code_id"])})
-            if promo:
-                post["promo_code"] = promo["code_encrypted"]
-                post["offer_description"] = promo["offer_description"]
+        query["location.name"] = {"$regex": re.escape(city), "$options": "i"}
     
-    return posts
+    return await feed_response(db.posts.aggregate(feed_pipeline(query, skip, limit)))
 
 @api_router.get("/posts/feed/following")
 async def get_following_feed(skip: int = 0, limit: int = 20, current_user: Dict = Depends(get_current_user)):
-    user = await db.users.find_one({"_id": ObjectId(current_user["user_id"])})
-    following = user.get("following", [])
-    
-    posts = await db.posts.find(
-        {"user_id": {"$in": following}, "promotion_status": {"$in": ["N/A", "Approved"]}}
-    ).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
+    following = [
+        follow["followee_id"]
+        async for follow in db.follows.find({"follower_id": current_user["user_oid"]}, {"followee_id": 1})
+    ]
     
-    # Enrich posts with user data
-    for post in posts:
-        post["_id"] = str(post["_id"])
-        user = await db.users.find_one({"_id": ObjectId(post["user_id"])})
-        if user:
-            post["user"] = {
-                "_id": str(user["_id"]),
-                "profile_name": user["profile_name"],
-                "handle": user["handle"],
-                "avatar_base64": user.get("avatar_base64"),
-                "user_type": user["user_type"]
-            }
-    
-    return posts
+    query = {"user_id": {"$in": following}, "promotion_status": {"$in": ["N/A", "Approved"]}}
+    return await feed_response(db.posts.aggregate(feed_pipeline(query, skip, limit)))
 
 @api_router.get("/posts/{post_id}")
 async def get_post(post_id: str):
-    post = await db.posts.find_one({"_id": ObjectId(post_id)})
+    post = await db.posts.find_one({"_id": ObjectId(post_id)}, POST_PROJECTION)
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
     
-    post["_id"] = str(post["_id"])
-    
     # Get user data
-    user = await db.users.find_one({"_id": ObjectId(post["user_id"])})
+    user = await db.users.find_one({"_id": post["user_id"]}, USER_SUMMARY_PROJECTION)
+    serialize_post(post)
     if user:
         post["user"] = {
             "_id": str(user["_id"]),
             "profile_name": user["profile_name"],
             "handle": user["handle"],
-            "avatar_base64": user.get("avatar_base64"),
+            "avatar_url": user.get("avatar_url"),
             "user_type": user["user_type"]
         }
     
@@ -413,44 +594,54 @@ async def unlike_post(post_id: str, current_user: Dict = Depends(get_current_use
 @api_router.post("/posts/{post_id}/comments")
 async def add_comment(post_id: str, comment: CommentCreate, current_user: Dict = Depends(get_current_user)):
     comment_obj = {
-        "user_id": current_user["user_id"],
+        "post_id": post_id,
+        "user_id": current_user["user_oid"],
         "text": comment.text,
-        "created_at": datetime.utcnow()
+        "created_at": datetime.now(timezone.utc)
     }
     
-    await db.posts.update_one(
+    result = await db.posts.update_one(
         {"_id": ObjectId(post_id)},
-        {"$push": {"comments": comment_obj}}
+        {"$inc": {"comment_count": 1}}
     )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Post not found")
+    
+    await db.comments.insert_one(comment_obj)
     
     return {"message": "Comment added"}
 
 @api_router.get("/posts/{post_id}/comments")
-async def get_comments(post_id: str):
-    post = await db.posts.find_one({"_id": ObjectId(post_id)})
+async def get_comments(post_id: str, skip: int = 0, limit: int = 50):
+    post, comments = await asyncio.gather(
+        db.posts.find_one({"_id": ObjectId(post_id)}, {"_id": 1}),
+        db.comments.find({"post_id": post_id}).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
+    )
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
     
-    comments = post.get("comments", [])
+    users_by_id = await fetch_users_by_id(comment["user_id"] for comment in comments)
     
     # Enrich with user data
     for comment in comments:
-        user = await db.users.find_one({"_id": ObjectId(comment["user_id"])})
+        comment["_id"] = str(comment["_id"])
+        comment["user_id"] = str(comment["user_id"])
+        user = users_by_id.get(comment["user_id"])
         if user:
             comment["user"] = {
                 "profile_name": user["profile_name"],
                 "handle": user["handle"],
-                "avatar_base64": user.get("avatar_base64")
+                "avatar_url": user.get("avatar_url")
             }
     
     return comments
 
 @api_router.get("/users/{user_id}/posts")
 async def get_user_posts(user_id: str, skip: int = 0, limit: int = 20):
-    posts = await db.posts.find({"user_id": user_id}).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
+    posts = await db.posts.find({"user_id": parse_object_id(user_id, "user id")}, POST_PROJECTION).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
     
     for post in posts:
-        post["_id"] = str(post["_id"])
+        serialize_post(post)
     
     return posts
 
@@ -461,21 +652,23 @@ async def get_promo_requests(restaurant_id: str, current_user: Dict = Depends(ge
         raise HTTPException(status_code=403, detail="Not authorized")
     
     posts = await db.posts.find({
-        "restaurant_tagged_id": restaurant_id,
+        "restaurant_tagged_id": current_user["user_oid"],
         "is_promotion_request": True,
         "promotion_status": "Pending"
-    }).to_list(100)
+    }, POST_PROJECTION).to_list(100)
+    
+    users_by_id = await fetch_users_by_id(post["user_id"] for post in posts)
     
     # Enrich with user data
     for post in posts:
-        post["_id"] = str(post["_id"])
-        user = await db.users.find_one({"_id": ObjectId(post["user_id"])})
+        serialize_post(post)
+        user = users_by_id.get(post["user_id"])
         if user:
             post["user"] = {
                 "_id": str(user["_id"]),
                 "profile_name": user["profile_name"],
                 "handle": user["handle"],
-                "avatar_base64": user.get("avatar_base64")
+                "avatar_url": user.get("avatar_url")
             }
     
     return posts
@@ -485,40 +678,43 @@ async def approve_promo(restaurant_id: str, post_id: str, promo: PromoApprove, c
     if current_user["user_id"] != restaurant_id:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    post = await db.posts.find_one({"_id": ObjectId(post_id)})
+    post = await db.posts.find_one({"_id": ObjectId(post_id)}, {"user_id": 1})
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
     
+    promoter_id = str(post["user_id"])
+    
     # Encrypt promo code
     encrypted_code = encrypt_promo_code(
         promo.promo_code_plain_text,
-        post["user_id"],
+        promoter_id,
         restaurant_id,
         post_id
     )
     
     # Create promo code entry
+    now = datetime.now(timezone.utc)
     promo_dict = {
         "code_encrypted": encrypted_code,
-        "promoter_foodie_id": post["user_id"],
+        "promoter_foodie_id": promoter_id,
         "restaurant_id": restaurant_id,
         "post_id": post_id,
         "offer_description": promo.offer_description,
         "expiry_date": promo.expiry_date,
         "redemptions": [],
-        "created_at": datetime.utcnow()
+        "created_at": now
     }
     
     result = await db.promocodes.insert_one(promo_dict)
     promo_code_id = str(result.inserted_id)
     
-    # Update post
+    # Update post only once the promo code exists, so it never points at a missing code
     await db.posts.update_one(
         {"_id": ObjectId(post_id)},
         {"$set": {
             "promotion_status": "Approved",
             "promo_code_id": promo_code_id,
-            "updated_at": datetime.utcnow()
+            "updated_at": now
         }}
     )
     
@@ -531,7 +727,7 @@ async def reject_promo(restaurant_id: str, post_id: str, current_user: Dict = De
     
     await db.posts.update_one(
         {"_id": ObjectId(post_id)},
-        {"$set": {"promotion_status": "Rejected", "updated_at": datetime.utcnow()}}
+        {"$set": {"promotion_status": "Rejected", "updated_at": datetime.now(timezone.utc)}}
     )
     
     return {"message": "Promo rejected"}
@@ -549,62 +745,50 @@ async def redeem_promo(restaurant_id: str, redemption: PromoRedeem, current_user
         raise HTTPException(status_code=400, detail="Invalid promo code for this restaurant")
     
     # Find promo code
-    promo = await db.promocodes.find_one({"post_id": decrypted["post_id"]})
+    promo = await db.promocodes.find_one({"post_id": decrypted["post_id"]}, {"expiry_date": 1})
     if not promo:
         raise HTTPException(status_code=404, detail="Promo code not found")
     
-    # Check expiry
+    now = datetime.now(timezone.utc)
+    
+    # Check expiry; dates without an offset are taken as UTC
     if promo.get("expiry_date"):
         expiry = datetime.fromisoformat(promo["expiry_date"])
-        if datetime.utcnow() > expiry:
+        if expiry.tzinfo is None:
+            expiry = expiry.replace(tzinfo=timezone.utc)
+        if now > expiry:
             raise HTTPException(status_code=400, detail="Promo code expired")
     
     # Add redemption
     redemption_obj = {
         "redeemer_user_id": redemption.redeemer_user_id,
-        "redeemed_at": datetime.utcnow(),
+        "redeemed_at": now,
         "restaurant_confirmation_status": "Confirmed"
     }
     
-    await db.promocodes.update_one(
+    record_redemption = db.promocodes.update_one(
         {"_id": promo["_id"]},
         {"$push": {"redemptions": redemption_obj}}
     )
     
-    # Update loyalty points
+    # Update loyalty points; the upsert creates the record on a foodie's first redemption
     promoter_id = decrypted["promoter_id"]
-    loyalty = await db.loyalty_points.find_one({
-        "restaurant_id": restaurant_id,
-        "foodie_id": promoter_id
-    })
-    
-    if loyalty:
-        await db.loyalty_points.update_one(
-            {"_id": loyalty["_id"]},
-            {
-                "$inc": {"points": 10},
-                "$push": {"transactions": {
-                    "amount": 10,
-                    "type": "Earned",
-                    "source_promo_code_id": str(promo["_id"]),
-                    "date": datetime.utcnow()
-                }},
-                "$set": {"last_updated": datetime.utcnow()}
-            }
-        )
-    else:
-        await db.loyalty_points.insert_one({
-            "restaurant_id": restaurant_id,
-            "foodie_id": promoter_id,
-            "points": 10,
-            "transactions": [{
+    award_points = db.loyalty_points.update_one(
+        {"restaurant_id": restaurant_id, "foodie_id": promoter_id},
+        {
+            "$inc": {"points": 10},
+            "$push": {"transactions": {
                 "amount": 10,
                 "type": "Earned",
                 "source_promo_code_id": str(promo["_id"]),
-                "date": datetime.utcnow()
-            }],
-            "last_updated": datetime.utcnow()
-        })
+                "date": now
+            }},
+            "$set": {"last_updated": now}
+        },
+        upsert=True
+    )
+    
+    await asyncio.gather(record_redemption, award_points)
     
     return {"message": "Promo redeemed successfully", "points_awarded": 10}
 
@@ -615,15 +799,16 @@ async def get_loyalty_points(foodie_id: str, current_user: Dict = Depends(get_cu
         raise HTTPException(status_code=403, detail="Not authorized")
     
     loyalty_points = await db.loyalty_points.find({"foodie_id": foodie_id}).to_list(100)
+    restaurants_by_id = await fetch_users_by_id(lp["restaurant_id"] for lp in loyalty_points)
     
     for lp in loyalty_points:
         lp["_id"] = str(lp["_id"])
         # Get restaurant info
-        restaurant = await db.users.find_one({"_id": ObjectId(lp["restaurant_id"])})
+        restaurant = restaurants_by_id.get(lp["restaurant_id"])
         if restaurant:
             lp["restaurant"] = {
                 "profile_name": restaurant["profile_name"],
-                "avatar_base64": restaurant.get("avatar_base64")
+                "avatar_url": restaurant.get("avatar_url")
             }
     
     return loyalty_points
@@ -634,22 +819,24 @@ async def get_restaurant_loyalty_points(restaurant_id: str, current_user: Dict =
         raise HTTPException(status_code=403, detail="Not authorized")
     
     loyalty_points = await db.loyalty_points.find({"restaurant_id": restaurant_id}).to_list(100)
+    foodies_by_id = await fetch_users_by_id(lp["foodie_id"] for lp in loyalty_points)
     
     for lp in loyalty_points:
         lp["_id"] = str(lp["_id"])
         # Get foodie info
-        foodie = await db.users.find_one({"_id": ObjectId(lp["foodie_id"])})
+        foodie = foodies_by_id.get(lp["foodie_id"])
         if foodie:
             lp["foodie"] = {
                 "profile_name": foodie["profile_name"],
                 "handle": foodie["handle"],
-                "avatar_base64": foodie.get("avatar_base64")
+                "avatar_url": foodie.get("avatar_url")
             }
     
     return loyalty_points
 
 # Include router
 app.include_router(api_router)
+app.mount(AVATAR_URL_PREFIX, StaticFiles(directory=AVATAR_DIR), name="avatars")
 
 app.add_middleware(
     CORSMiddleware,
@@ -665,6 +852,34 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def create_indexes():
+    # Unique indexes over legacy collections are built by migrate.py, which clears duplicates first
+    await asyncio.gather(
+        db.users.create_index([("user_type", 1)]),
+        db.users.create_index([("profile_name_lower", 1)]),
+        db.users.create_index([("handle_lower", 1)]),
+        db.posts.create_index([("user_id", 1), ("created_at", -1)]),
+        db.posts.create_index([("promotion_status", 1), ("created_at", -1)]),
+        db.posts.create_index([("restaurant_tagged_id", 1), ("is_promotion_request", 1), ("promotion_status", 1)]),
+        db.comments.create_index([("post_id", 1), ("created_at", -1)]),
+        db.follows.create_index([("follower_id", 1), ("followee_id", 1)], unique=True),
+        db.follows.create_index([("followee_id", 1)]),
+        db.promocodes.create_index([("post_id", 1)]),
+        db.loyalty_points.create_index([("restaurant_id", 1)]),
+    )
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
     client.close()
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(
+        "server:app",
+        host=os.environ.get('HOST', '0.0.0.0'),
+        port=int(os.environ.get('PORT', '8001')),
+        workers=int(os.environ.get('WEB_CONCURRENCY', '1')),
+        loop="uvloop",
+        http="httptools"
+    )
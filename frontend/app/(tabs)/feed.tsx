@@ -13,7 +13,7 @@ import {
 } from 'react-native';
 import { SafeAreaView } from 'react-native-safe-area-context';
 import { Ionicons } from '@expo/vector-icons';
-import { postAPI } from '../../services/api';
+import { postAPI, assetUrl } from '../../services/api';
 import { useAuthStore } from '../../store/authStore';
 import { format } from 'date-fns';
 
@@ -26,12 +26,12 @@ interface Post {
   caption: string;
   stars?: number;
   likes: string[];
-  comments: any[];
+  comment_count: number;
   created_at: string;
   user: {
     profile_name: string;
     handle: string;
-    avatar_base64?: string;
+    avatar_url?: string;
   };
   promo_code?: string;
   offer_description?: string;
@@ -98,9 +98,9 @@ export default function FeedScreen() {
       <View style={styles.postCard}>
         <View style={styles.postHeader}>
           <View style={styles.userInfo}>
-            {item.user.avatar_base64 ? (
+            {item.user.avatar_url ? (
               <Image
-                source={{ uri: `data:image/jpeg;base64,${item.user.avatar_base64}` }}
+                source={{ uri: assetUrl(item.user.avatar_url) }}
                 style={styles.avatar}
               />
             ) : (
@@ -173,9 +173,9 @@ export default function FeedScreen() {
             </TouchableOpacity>
           )}
 
-          {item.comments.length > 0 && (
+          {item.comment_count > 0 && (
             <Text style={styles.viewComments}>
-              View all {item.comments.length} comments
+              View all {item.comment_count} comments
             </Text>
           )}
 
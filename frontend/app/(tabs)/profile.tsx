@@ -14,7 +14,7 @@ import {
 import { SafeAreaView } from 'react-native-safe-area-context';
 import { Ionicons } from '@expo/vector-icons';
 import { useAuthStore } from '../../store/authStore';
-import { userAPI, authAPI, promoAPI, loyaltyAPI } from '../../services/api';
+import { userAPI, authAPI, promoAPI, loyaltyAPI, assetUrl } from '../../services/api';
 import { useRouter } from 'expo-router';
 import MapLocationPicker from '../../components/MapLocationPicker';
 
@@ -31,7 +31,7 @@ interface PromoRequest {
   user: {
     profile_name: string;
     handle: string;
-    avatar_base64?: string;
+    avatar_url?: string;
   };
   image_base64: string;
   caption: string;
@@ -172,9 +172,9 @@ export default function ProfileScreen() {
 
       <ScrollView>
         <View style={styles.profileHeader}>
-          {user.avatar_base64 ? (
+          {user.avatar_url ? (
             <Image
-              source={{ uri: `data:image/jpeg;base64,${user.avatar_base64}` }}
+              source={{ uri: assetUrl(user.avatar_url) }}
               style={styles.avatar}
             />
           ) : (
@@ -198,11 +198,11 @@ export default function ProfileScreen() {
               <Text style={styles.statLabel}>Posts</Text>
             </View>
             <View style={styles.stat}>
-              <Text style={styles.statNumber}>{user.followers?.length || 0}</Text>
+              <Text style={styles.statNumber}>{user.follower_count || 0}</Text>
               <Text style={styles.statLabel}>Followers</Text>
             </View>
             <View style={styles.stat}>
-              <Text style={styles.statNumber}>{user.following?.length || 0}</Text>
+              <Text style={styles.statNumber}>{user.following_count || 0}</Text>
               <Text style={styles.statLabel}>Following</Text>
             </View>
           </View>
@@ -295,9 +295,9 @@ export default function ProfileScreen() {
             {promoRequests.map((request) => (
               <View key={request._id} style={styles.promoCard}>
                 <View style={styles.promoHeader}>
-                  {request.user.avatar_base64 ? (
+                  {request.user.avatar_url ? (
                     <Image
-                      source={{ uri: `data:image/jpeg;base64,${request.user.avatar_base64}` }}
+                      source={{ uri: assetUrl(request.user.avatar_url) }}
                       style={styles.promoAvatar}
                     />
                   ) : (
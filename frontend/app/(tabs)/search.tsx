@@ -10,14 +10,14 @@ import {
 } from 'react-native';
 import { SafeAreaView } from 'react-native-safe-area-context';
 import { Ionicons } from '@expo/vector-icons';
-import { userAPI } from '../../services/api';
+import { userAPI, assetUrl } from '../../services/api';
 import { useRouter } from 'expo-router';
 
 interface SearchUser {
   _id: string;
   profile_name: string;
   handle: string;
-  avatar_base64?: string;
+  avatar_url?: string;
   user_type: string;
 }
 
@@ -54,9 +54,9 @@ export default function SearchScreen() {
         console.log('Navigate to user:', item._id);
       }}
     >
-      {item.avatar_base64 ? (
+      {item.avatar_url ? (
         <Image
-          source={{ uri: `data:image/jpeg;base64,${item.avatar_base64}` }}
+          source={{ uri: assetUrl(item.avatar_url) }}
           style={styles.avatar}
         />
       ) : (
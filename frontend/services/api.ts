@@ -3,6 +3,9 @@ import * as SecureStore from 'expo-secure-store';
 
 const API_URL = process.env.EXPO_PUBLIC_BACKEND_URL || '';
 
+// Resolve a server-relative asset path (e.g. an avatar_url) to a full URL
+export const assetUrl = (path: string) => API_URL + path;
+
 const api = axios.create({
   baseURL: API_URL + '/api',
   headers: {
@@ -48,7 +51,8 @@ export const postAPI = {
   unlikePost: (postId: string) => api.post(`/posts/${postId}/unlike`),
   addComment: (postId: string, text: string) => 
     api.post(`/posts/${postId}/comments`, { text }),
-  getComments: (postId: string) => api.get(`/posts/${postId}/comments`),
+  getComments: (postId: string, skip = 0, limit = 50) => 
+    api.get(`/posts/${postId}/comments`, { params: { skip, limit } }),
 };
 
 export const promoAPI = {
@@ -8,11 +8,11 @@ interface User {
   user_type: 'Foodie' | 'Restaurant';
   profile_name: string;
   handle: string;
-  avatar_base64?: string;
+  avatar_url?: string;
   email?: string;
   bio?: string;
-  followers?: string[];
-  following?: string[];
+  follower_count?: number;
+  following_count?: number;
   restaurant_details?: any;
 }
 
@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# server.py reads its configuration at import time; the Motor client does not
+# connect until the first query, so no database is needed for these tests
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("APP_ENV", "development")
+os.environ.setdefault("AVATAR_DIR", tempfile.mkdtemp())
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
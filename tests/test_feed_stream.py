@@ -0,0 +1,62 @@
+import asyncio
+from datetime import datetime
+
+import orjson
+import pytest
+import server
+from bson import ObjectId
+
+
+class FakeCursor:
+    """Stands in for a Motor aggregate cursor over an in-memory list of posts."""
+
+    def __init__(self, posts, error=None):
+        self._posts = iter(posts)
+        self._error = error
+
+    async def next(self):
+        if self._error:
+            raise self._error
+        for post in self._posts:
+            return post
+        raise StopAsyncIteration
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.next()
+
+
+def make_post(caption):
+    return {
+        "_id": ObjectId(),
+        "user_id": ObjectId(),
+        "caption": caption,
+        "created_at": datetime(2024, 5, 1, 12, 30),
+        "user": {"_id": ObjectId(), "profile_name": "Ana", "handle": "ana"},
+    }
+
+
+async def read_feed(posts):
+    response = await server.feed_response(FakeCursor(posts))
+    return b"".join([chunk async for chunk in response.body_iterator])
+
+
+@pytest.mark.parametrize("count", [0, 1, 3])
+def test_feed_stream_is_a_json_array_of_posts(count):
+    posts = [make_post(f"post {i}") for i in range(count)]
+    expected_ids = [str(post["_id"]) for post in posts]
+    expected_user_ids = [str(post["user"]["_id"]) for post in posts]
+
+    body = asyncio.run(read_feed(posts))
+
+    feed = orjson.loads(body)
+    assert [post["_id"] for post in feed] == expected_ids
+    assert [post["user"]["_id"] for post in feed] == expected_user_ids
+    assert [post["caption"] for post in feed] == [f"post {i}" for i in range(count)]
+
+
+def test_feed_query_errors_raise_before_streaming():
+    with pytest.raises(RuntimeError):
+        asyncio.run(server.feed_response(FakeCursor([], error=RuntimeError("server selection timed out"))))
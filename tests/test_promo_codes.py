@@ -0,0 +1,66 @@
+import base64
+
+import pytest
+import server
+from fastapi import HTTPException
+
+
+def test_promo_code_round_trip():
+    code = server.encrypt_promo_code("TENOFF", "foodie1", "resto1", "post1", "dish1")
+
+    assert server.decrypt_promo_code(code) == {
+        "promo_text": "TENOFF",
+        "promoter_id": "foodie1",
+        "restaurant_id": "resto1",
+        "post_id": "post1",
+        "dish_id": "dish1",
+    }
+
+
+def test_promo_codes_use_fresh_nonces():
+    first = server.encrypt_promo_code("TENOFF", "foodie1", "resto1", "post1")
+    second = server.encrypt_promo_code("TENOFF", "foodie1", "resto1", "post1")
+
+    assert first != second
+
+
+def test_legacy_fernet_promo_code_still_decrypts():
+    token = server.fernet.encrypt(b"TENOFF|foodie1|resto1|post1")
+    legacy_code = base64.urlsafe_b64encode(token).decode()
+
+    decrypted = server.decrypt_promo_code(legacy_code)
+
+    assert decrypted["promo_text"] == "TENOFF"
+    assert decrypted["post_id"] == "post1"
+    assert decrypted["dish_id"] == ""
+
+
+def test_tampered_promo_code_is_rejected():
+    raw = bytearray(base64.urlsafe_b64decode(server.encrypt_promo_code("TENOFF", "foodie1", "resto1", "post1")))
+    raw[-1] ^= 1
+
+    with pytest.raises(HTTPException) as excinfo:
+        server.decrypt_promo_code(base64.urlsafe_b64encode(bytes(raw)).decode())
+    assert excinfo.value.status_code == 400
+
+
+def test_decryption_is_cached_by_ciphertext():
+    server._decrypt_promo_fields.cache_clear()
+    code = server.encrypt_promo_code("TENOFF", "foodie1", "resto1", "post1")
+
+    server.decrypt_promo_code(code)
+    server.decrypt_promo_code(code)
+
+    info = server._decrypt_promo_fields.cache_info()
+    assert (info.hits, info.misses, info.currsize) == (1, 1, 1)
+
+
+def test_failed_decryption_is_not_cached():
+    server._decrypt_promo_fields.cache_clear()
+
+    for _ in range(2):
+        with pytest.raises(HTTPException):
+            server.decrypt_promo_code("not-a-promo-code")
+
+    info = server._decrypt_promo_fields.cache_info()
+    assert (info.hits, info.currsize) == (0, 0)